@@ -5,6 +5,7 @@ from django.db.transaction import *
 from pgtransaction.transaction import (
     Atomic,
     atomic,
+    on_commit_batch,
     READ_COMMITTED,
     REPEATABLE_READ,
     SERIALIZABLE,
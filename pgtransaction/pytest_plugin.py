@@ -0,0 +1,313 @@
+"""
+A pytest plugin for asserting query, round trip, retry, and hold time budgets
+on [pgtransaction.atomic][] blocks.
+
+The plugin is registered automatically with pytest when `django-pgtransaction`
+is installed and is meant to be used alongside `pytest-django`.
+"""
+
+import re
+import sys
+import threading
+import time
+from functools import wraps
+from typing import List, Union
+
+import pytest
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from pgtransaction.transaction import Atomic
+
+# SQL statements that control the transaction rather than doing work in it
+_TRANSACTION_CONTROL_RE = re.compile(
+    r"^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE\s+SAVEPOINT|SET\s+TRANSACTION)\b",
+    re.IGNORECASE,
+)
+_BEGIN_RE = re.compile(r"^\s*BEGIN\b", re.IGNORECASE)
+
+# Trackers that are currently recording blocks, and the number of tracked
+# blocks that are still open in any thread
+_trackers: List["Tracker"] = []
+_num_open_blocks = 0
+_trackers_lock = threading.Lock()
+
+# Originals of the Atomic methods that are wrapped while trackers are active
+_atomic_enter = Atomic.__enter__
+_atomic_exit = Atomic.__exit__
+
+# The open blocks of the current thread
+_local = threading.local()
+
+
+class Block:
+    """A record of one attempt of a [pgtransaction.atomic][] block.
+
+    Attributes:
+        name: The decorated function, or the file and line of the `with`
+            statement when used as a context manager.
+        using: The database alias of the block.
+        retries: The number of retries that preceded this attempt.
+        sql: Every statement sent to the database during the block,
+            including transaction control statements such as `SAVEPOINT`
+            and `SET TRANSACTION`. The `BEGIN` and the final `COMMIT` or
+            `ROLLBACK` are included for outermost blocks that ran SQL.
+            SQL from commit hooks is not included.
+        duration: How long the block was held open in seconds, until its
+            `COMMIT` or `ROLLBACK` returned.
+    """
+
+    def __init__(self, name: str, using: str, retries: int):
+        self.name = name
+        self.using = using
+        self.retries = retries
+        self.sql: List[str] = []
+        self.duration = 0.0
+
+    @property
+    def statements(self) -> int:
+        """The number of statements, excluding transaction control statements."""
+        return len([sql for sql in self.sql if not _TRANSACTION_CONTROL_RE.match(sql)])
+
+    @property
+    def round_trips(self) -> int:
+        """The number of round trips to the database, including transaction control."""
+        return len(self.sql)
+
+    def __repr__(self):
+        return f"<Block {self.name} using={self.using!r} retries={self.retries}>"
+
+
+def _block_name(atomic, frame):
+    if atomic.func is not None:
+        return f"{atomic.func.__module__}.{atomic.func.__qualname__}"
+    else:
+        return f"{frame.f_code.co_filename}:{frame.f_lineno}"
+
+
+def _open_blocks():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+
+    return _local.stack
+
+
+def _patch_atomic():
+    # Blocks that are still open stay tracked after the last tracker exits so
+    # that their execute wrappers are removed
+    if _trackers or _num_open_blocks:
+        Atomic.__enter__ = _tracked_enter
+        Atomic.__exit__ = _tracked_exit
+    else:
+        Atomic.__enter__ = _atomic_enter
+        Atomic.__exit__ = _atomic_exit
+
+
+def _tracked_enter(self):
+    global _num_open_blocks
+
+    connection = self.connection
+    block = Block(
+        _block_name(self, sys._getframe(1)),
+        self.using or DEFAULT_DB_ALIAS,
+        self.num_retries,
+    )
+    outermost = not connection.in_atomic_block
+    committed = []
+
+    def record(execute, sql, params, many, context):
+        block.sql.append(sql)
+        return execute(sql, params, many, context)
+
+    connection.execute_wrappers.append(record)
+    with _trackers_lock:
+        _num_open_blocks += 1
+
+    _open_blocks().append((self, block, record, outermost, committed, time.perf_counter()))
+
+    try:
+        _atomic_enter(self)
+    except BaseException:
+        _close_block()
+        raise
+
+    if outermost:
+        # Commit hooks run in order once COMMIT returns, so the first one marks
+        # the end of the block
+        transaction.on_commit(lambda: committed.append(time.perf_counter()), using=self.using)
+
+
+def _tracked_exit(self, exc_type, exc_value, traceback):
+    stack = _open_blocks()
+    if not stack or stack[-1][0] is not self:
+        # The block was entered before any tracker was active
+        return _atomic_exit(self, exc_type, exc_value, traceback)
+
+    _, _, record, outermost, _, _ = stack[-1]
+    if outermost:
+        # The COMMIT or ROLLBACK of the outermost block doesn't go through a
+        # cursor, so stop recording before commit hooks run their own SQL
+        self.connection.execute_wrappers.remove(record)
+
+    try:
+        return _atomic_exit(self, exc_type, exc_value, traceback)
+    finally:
+        _close_block()
+
+
+def _close_block():
+    global _num_open_blocks
+
+    atomic, block, record, outermost, committed, start = _open_blocks().pop()
+    block.duration = (committed[0] if committed else time.perf_counter()) - start
+    if record in atomic.connection.execute_wrappers:
+        atomic.connection.execute_wrappers.remove(record)
+
+    # The driver only opens the transaction once SQL is run in it, and some
+    # backends run their own BEGIN. The outermost block was only committed if
+    # its commit hooks ran
+    if outermost and block.sql:
+        if not _BEGIN_RE.match(block.sql[0]):  # pragma: no branch
+            block.sql.insert(0, "BEGIN")
+
+        block.sql.append("COMMIT" if committed else "ROLLBACK")
+
+    with _trackers_lock:
+        for tracker in _trackers:
+            tracker.blocks.append(block)
+
+        _num_open_blocks -= 1
+        _patch_atomic()
+
+
+class Tracker:
+    """Records [pgtransaction.atomic][] blocks and asserts they stay within a budget.
+
+    Used by the `pgtransaction_budget` fixture and marker. Every limit is
+    checked against each attempt of each block that finishes while the
+    tracker is active, including nested blocks. Limits that are `None`
+    are not checked.
+
+    Args:
+        max_statements: The maximum number of statements, excluding
+            transaction control statements such as `SAVEPOINT` and
+            `SET TRANSACTION`.
+        max_round_trips: The maximum number of round trips to the
+            database, including transaction control statements. Outermost
+            blocks that ran SQL also count the `BEGIN` and the final
+            `COMMIT` or `ROLLBACK`.
+        max_retries: The maximum number of retries of a block.
+        max_hold_time: The maximum number of seconds a block is held open.
+    """
+
+    def __init__(
+        self,
+        max_statements: Union[int, None] = None,
+        max_round_trips: Union[int, None] = None,
+        max_retries: Union[int, None] = None,
+        max_hold_time: Union[float, None] = None,
+    ):
+        self.max_statements = max_statements
+        self.max_round_trips = max_round_trips
+        self.max_retries = max_retries
+        self.max_hold_time = max_hold_time
+        self.blocks: List[Block] = []
+
+    def __enter__(self):
+        with _trackers_lock:
+            _trackers.append(self)
+            _patch_atomic()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with _trackers_lock:
+            _trackers.remove(self)
+            _patch_atomic()
+
+        if exc_type is None:
+            self.check()
+
+    def violations(self, block: Block) -> List[str]:
+        """Return the limits exceeded by a block."""
+        limits = [
+            ("statements", block.statements, self.max_statements),
+            ("round trips", block.round_trips, self.max_round_trips),
+            ("retries", block.retries, self.max_retries),
+            ("hold time", round(block.duration, 4), self.max_hold_time),
+        ]
+        return [
+            f"{label}: {value} > {limit}"
+            for label, value, limit in limits
+            if limit is not None and value > limit
+        ]
+
+    def check(self):
+        """Raise an `AssertionError` if any recorded block exceeded the budget."""
+        report = []
+        for block in self.blocks:
+            violations = self.violations(block)
+            if violations:
+                report.append(f'{block.name} (using "{block.using}", retries={block.retries}):')
+                report.extend(f"    {violation}" for violation in violations)
+                report.append("    SQL:")
+                report.extend(f"        {sql}" for sql in block.sql)
+
+        if report:
+            raise AssertionError("pgtransaction.atomic budget exceeded:\n" + "\n".join(report))
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers",
+        "pgtransaction_budget(max_statements=None, max_round_trips=None, max_retries=None, "
+        "max_hold_time=None): Assert every pgtransaction.atomic block in the test "
+        "stays within the budget.",
+    )
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_pyfunc_call(pyfuncitem):
+    marker = pyfuncitem.get_closest_marker("pgtransaction_budget")
+    if marker is None:
+        yield
+        return
+
+    # Run the test function itself in the tracker so that an exceeded budget
+    # fails the test
+    func = pyfuncitem.obj
+
+    @wraps(func)
+    def tracked(*args, **kwargs):
+        with Tracker(*marker.args, **marker.kwargs):
+            return func(*args, **kwargs)
+
+    pyfuncitem.obj = tracked
+    try:
+        yield
+    finally:
+        pyfuncitem.obj = func
+
+
+@pytest.fixture
+def pgtransaction_budget():
+    """Assert [pgtransaction.atomic][] blocks stay within a budget.
+
+    Returns a [pgtransaction.pytest_plugin.Tracker][] class that is used
+    as a context manager. An `AssertionError` is raised when exiting if a
+    block finished inside of the context manager and exceeded a limit.
+
+    Example:
+        Assert that `update_trades` issues no more than three statements,
+        five round trips, and one retry in any of its blocks:
+
+            def test_update_trades(pgtransaction_budget):
+                with pgtransaction_budget(max_statements=3, max_round_trips=5, max_retries=1):
+                    update_trades()
+
+        The `pgtransaction_budget` marker applies a budget to the whole test:
+
+            @pytest.mark.pgtransaction_budget(max_statements=3, max_hold_time=0.5)
+            def test_update_trades():
+                update_trades()
+    """
+    return Tracker
@@ -0,0 +1,220 @@
+import time
+
+import pytest
+from django.db import connection, transaction
+from django.db.utils import OperationalError
+
+import pgtransaction
+from pgtransaction import pytest_plugin
+from pgtransaction.tests.models import Trade
+from pgtransaction.transaction import Atomic, atomic
+
+try:
+    import psycopg.errors as psycopg_errors
+except ImportError:
+    import psycopg2.errors as psycopg_errors
+
+pytest_plugins = ["pytester"]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_budget_outermost_block(pgtransaction_budget):
+    with pgtransaction_budget(max_statements=1, max_round_trips=4) as tracker:
+        with atomic(isolation_level=pgtransaction.REPEATABLE_READ):
+            Trade.objects.create(company="a", price=1)
+            # SQL from commit hooks is not counted
+            transaction.on_commit(lambda: Trade.objects.count())
+
+    assert len(tracker.blocks) == 1
+    block = tracker.blocks[0]
+    assert block.name.startswith(f"{__file__}:")
+    assert block.using == "default"
+    assert block.retries == 0
+    assert block.statements == 1
+    assert block.round_trips == 4
+    assert block.sql[0] == "BEGIN"
+    assert block.sql[1] == "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"
+    assert block.sql[2].startswith("INSERT INTO")
+    assert block.sql[3] == "COMMIT"
+    assert not connection.execute_wrappers
+
+
+@pytest.mark.django_db()
+def test_budget_nested_blocks(pgtransaction_budget):
+    @atomic
+    def create():
+        Trade.objects.create(company="a", price=1)
+        with atomic():
+            Trade.objects.create(company="b", price=1)
+
+    with pgtransaction_budget() as tracker:
+        create()
+
+    inner, outer = tracker.blocks
+    assert repr(outer) == f"<Block {outer.name} using='default' retries=0>"
+    assert outer.name.endswith("test_budget_nested_blocks.<locals>.create")
+    assert outer.statements == 2
+    assert outer.round_trips == 6
+    assert outer.sql[0].startswith("SAVEPOINT")
+    assert inner.statements == 1
+    assert inner.round_trips == 3
+    assert inner.sql[-1].startswith("RELEASE SAVEPOINT")
+
+
+@pytest.mark.django_db()
+def test_budget_exceeded(pgtransaction_budget):
+    @atomic
+    def create():
+        Trade.objects.create(company="a", price=1)
+        Trade.objects.create(company="b", price=1)
+
+    with pytest.raises(AssertionError) as exc_info:
+        with pgtransaction_budget(max_statements=1, max_round_trips=3):
+            create()
+
+    message = str(exc_info.value)
+    assert "test_budget_exceeded.<locals>.create" in message
+    assert "statements: 2 > 1" in message
+    assert "round trips: 4 > 3" in message
+    assert "INSERT INTO" in message
+
+
+@pytest.mark.django_db(transaction=True)
+def test_budget_retries_exceeded(pgtransaction_budget):
+    attempts = []
+
+    @atomic(retry=1)
+    def create():
+        attempts.append(True)
+        Trade.objects.create(company=str(len(attempts)), price=1)
+        if len(attempts) == 1:
+            raise OperationalError from psycopg_errors.SerializationFailure
+
+    with pytest.raises(AssertionError, match="retries: 1 > 0"):
+        with pgtransaction_budget(max_retries=0) as tracker:
+            create()
+
+    assert [block.retries for block in tracker.blocks] == [0, 1]
+    assert [(block.sql[0], block.sql[-1]) for block in tracker.blocks] == [
+        ("BEGIN", "ROLLBACK"),
+        ("BEGIN", "COMMIT"),
+    ]
+
+
+@pytest.mark.django_db()
+def test_budget_hold_time_exceeded(pgtransaction_budget):
+    with pytest.raises(AssertionError, match="hold time"):
+        with pgtransaction_budget(max_hold_time=0.001):
+            with atomic():
+                time.sleep(0.01)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_budget_failed_enter(pgtransaction_budget):
+    with pgtransaction_budget() as tracker:
+        with pytest.raises(RuntimeError, match="as a context manager"):
+            with atomic(retry=1):
+                pass
+
+    assert len(tracker.blocks) == 1
+    assert not connection.execute_wrappers
+
+    # Blocks are no longer recorded once the tracker exits
+    with atomic():
+        pass
+
+    assert len(tracker.blocks) == 1
+
+
+@pytest.mark.django_db()
+def test_budget_nested_trackers(pgtransaction_budget):
+    with pgtransaction_budget() as outer:
+        with pytest.raises(AssertionError, match="statements: 1 > 0"):
+            with pgtransaction_budget(max_statements=0) as inner:
+                with atomic():
+                    Trade.objects.create(company="a", price=1)
+
+        with atomic():
+            pass
+
+    assert len(inner.blocks) == 1
+    assert len(outer.blocks) == 2
+
+
+@pytest.mark.django_db()
+def test_budget_exits_inside_block(pgtransaction_budget):
+    tracker = pgtransaction_budget()
+    tracker.__enter__()
+    with atomic():
+        tracker.__exit__(None, None, None)
+        assert Atomic.__exit__ is pytest_plugin._tracked_exit
+        Trade.objects.create(company="a", price=1)
+
+    # The block's execute wrapper is removed once it exits
+    assert not tracker.blocks
+    assert not connection.execute_wrappers
+    assert Atomic.__enter__ is pytest_plugin._atomic_enter
+    assert Atomic.__exit__ is pytest_plugin._atomic_exit
+
+
+@pytest.mark.django_db()
+def test_budget_enters_inside_block(pgtransaction_budget):
+    block = atomic()
+    block.__enter__()
+    with pgtransaction_budget() as tracker:
+        Trade.objects.create(company="a", price=1)
+        block.__exit__(None, None, None)
+
+    assert not tracker.blocks
+    assert not connection.execute_wrappers
+
+
+@pytest.mark.django_db()
+def test_budget_not_checked_on_error(pgtransaction_budget):
+    with pytest.raises(RuntimeError):
+        with pgtransaction_budget(max_statements=0):
+            with atomic():
+                Trade.objects.create(company="a", price=1)
+            raise RuntimeError
+
+
+@pytest.mark.django_db()
+@pytest.mark.pgtransaction_budget(max_statements=1, max_round_trips=3, max_retries=0)
+def test_budget_marker():
+    with atomic():
+        Trade.objects.create(company="a", price=1)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_budget_marker_exceeded(pytester):
+    # Django is already set up and the database is unblocked for this test, so
+    # the inner run doesn't load pytest-django
+    pytester.makepyfile(
+        """
+        import pytest
+        from django.db import connection
+
+        import pgtransaction
+
+        @pytest.mark.pgtransaction_budget(max_statements=0)
+        def test_exceeded():
+            @pgtransaction.atomic
+            def select():
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+
+            select()
+        """
+    )
+
+    result = pytester.runpytest("-p", "no:django", "-p", "no:cacheprovider")
+
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*pgtransaction.atomic budget exceeded:*",
+            '*test_exceeded.<locals>.select (using "default", retries=0):*',
+            "*statements: 1 > 0*",
+            "*SELECT 1*",
+        ]
+    )
@@ -3,7 +3,8 @@ import time
 
 import ddf
 import pytest
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.transaction import TransactionManagementError
 from django.db.utils import InternalError, OperationalError
 
 import pgtransaction
@@ -301,3 +302,171 @@ def test_concurrent_serialization_error():
     # We should have at least had three attempts. It's highly unlikely we would have four,
     # but the possibility exists.
     assert 3 <= len(calls) <= 4
+
+
+@pytest.mark.django_db(transaction=True)
+def test_on_commit_batch():
+    batches = []
+
+    with atomic():
+        pgtransaction.on_commit_batch(lambda: 1, key=1, batch=batches.append)
+        pgtransaction.on_commit_batch(lambda: 2, key=1, batch=batches.append)
+        with atomic():
+            pgtransaction.on_commit_batch(lambda: 3, key=2, batch=batches.append)
+        assert not batches
+
+    assert len(batches) == 1
+    assert [callback() for callback in batches[0]] == [1, 3]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_on_commit_batch_default_handler():
+    calls = []
+
+    def callback():
+        calls.append(True)
+
+    with atomic():
+        transaction.on_commit(lambda: calls.append(False))
+        pgtransaction.on_commit_batch(callback)
+        pgtransaction.on_commit_batch(callback)
+
+    # Batched callbacks run after the on_commit callbacks registered before them
+    assert calls == [False, True]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_on_commit_batch_rollback():
+    batches = []
+
+    with pytest.raises(RuntimeError):
+        with atomic():
+            pgtransaction.on_commit_batch(lambda: 1, batch=batches.append)
+            raise RuntimeError
+
+    with atomic():
+        pgtransaction.on_commit_batch(lambda: 1, key=1, batch=batches.append)
+        try:
+            with atomic():
+                pgtransaction.on_commit_batch(lambda: 2, key=2, batch=batches.append)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+    assert len(batches) == 1
+    assert [callback() for callback in batches[0]] == [1]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_on_commit_batch_savepoint_rollback_same_key():
+    batches = []
+
+    with atomic():
+        try:
+            with atomic():
+                pgtransaction.on_commit_batch(lambda: 1, key=1, batch=batches.append)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+        # The rolled back callback doesn't take the key
+        pgtransaction.on_commit_batch(lambda: 2, key=1, batch=batches.append)
+
+    assert len(batches) == 1
+    assert [callback() for callback in batches[0]] == [2]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_on_commit_batch_hook_opens_transaction():
+    batches = []
+
+    def hook():
+        with atomic():
+            pgtransaction.on_commit_batch(lambda: 2, key=1, batch=batches.append)
+
+    with atomic():
+        transaction.on_commit(hook)
+        pgtransaction.on_commit_batch(lambda: 1, key=1, batch=batches.append)
+
+    assert [[callback() for callback in batch] for batch in batches] == [[2], [1]]
+
+
+@pytest.mark.django_db()
+def test_on_commit_batch_capture(django_capture_on_commit_callbacks):
+    batches = []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        pgtransaction.on_commit_batch(lambda: 1, key=1, batch=batches.append)
+        pgtransaction.on_commit_batch(lambda: 2, key=2, batch=batches.append)
+        pgtransaction.on_commit_batch(lambda: 3, key=1, batch=batches.append)
+
+    assert [[callback() for callback in batch] for batch in batches] == [[1, 2]]
+
+    # Callbacks registered before the capture block aren't captured
+    batches.clear()
+    pgtransaction.on_commit_batch(lambda: 1, key=1, batch=batches.append)
+    with django_capture_on_commit_callbacks(execute=True):
+        pgtransaction.on_commit_batch(lambda: 2, key=2, batch=batches.append)
+
+    assert [[callback() for callback in batch] for batch in batches] == [[2]]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_on_commit_batch_flush_clears_callbacks():
+    with atomic():
+        pgtransaction.on_commit_batch(lambda: 1, batch=lambda callbacks: None)
+
+    assert connection.pgtransaction_batches.callbacks == {}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_on_commit_batch_retries():
+    attempts = []
+    batches = []
+
+    @atomic(retry=1)
+    def func():
+        attempts.append(True)
+        attempt = len(attempts)
+        pgtransaction.on_commit_batch(lambda: attempt, key=1, batch=batches.append)
+        if len(attempts) == 1:
+            raise OperationalError from psycopg_errors.SerializationFailure
+
+    func()
+    assert len(attempts) == 2
+    assert len(batches) == 1
+    assert [callback() for callback in batches[0]] == [2]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_on_commit_batch_without_pgtransaction_atomic():
+    batches = []
+
+    # Outside of a transaction, callbacks are passed to the batch handler immediately
+    pgtransaction.on_commit_batch(lambda: 1, batch=batches.append)
+    assert len(batches) == 1
+
+    # Callbacks are batched when the outermost block isn't pgtransaction.atomic
+    with transaction.atomic():
+        with atomic():
+            pgtransaction.on_commit_batch(lambda: 2, key=1, batch=batches.append)
+            pgtransaction.on_commit_batch(lambda: 3, key=1, batch=batches.append)
+        pgtransaction.on_commit_batch(lambda: 4, key=2, batch=batches.append)
+        assert len(batches) == 1
+
+    assert [[callback() for callback in batch] for batch in batches] == [[1], [2, 4]]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_on_commit_batch_errors():
+    with pytest.raises(TypeError, match="unhashable"):
+        with atomic():
+            pgtransaction.on_commit_batch(lambda: 1, key=[1])
+
+    transaction.set_autocommit(False)
+    try:
+        with pytest.raises(TransactionManagementError):
+            pgtransaction.on_commit_batch(lambda: 1)
+    finally:
+        transaction.rollback()
+        transaction.set_autocommit(True)
@@ -1,5 +1,6 @@
-from functools import wraps
-from typing import Union
+import copy
+from functools import partial, wraps
+from typing import Any, Callable, Hashable, List, Union
 
 import django
 from django.db import DEFAULT_DB_ALIAS, Error, transaction
@@ -28,6 +29,8 @@ class Atomic(transaction.Atomic):
 
         self.isolation_level = isolation_level
         self.retry = retry
+        self.func = None
+        self.num_retries = 0
         self._used_as_context_manager = True
 
         if self.isolation_level:  # pragma: no cover
@@ -50,6 +53,7 @@ class Atomic(transaction.Atomic):
 
     def __call__(self, func):
         self._used_as_context_manager = False
+        self.func = func
 
         @wraps(func)
         def inner(*args, **kwds):
@@ -57,7 +61,9 @@ class Atomic(transaction.Atomic):
 
             while True:  # pragma: no branch
                 try:
-                    with self._recreate_cm():
+                    # Each attempt gets its own copy since the decorator is shared
+                    # by every caller of the function
+                    with self._recreate_cm(num_retries):
                         return func(*args, **kwds)
                 except Error as error:
                     if (
@@ -70,6 +76,11 @@ class Atomic(transaction.Atomic):
 
         return inner
 
+    def _recreate_cm(self, num_retries=0):
+        attempt = copy.copy(self)
+        attempt.num_retries = num_retries
+        return attempt
+
     def execute_set_isolation_level(self):
         with self.connection.cursor() as cursor:
             cursor.execute(f"SET TRANSACTION ISOLATION LEVEL {self.isolation_level.upper()}")
@@ -101,6 +112,44 @@ class Atomic(transaction.Atomic):
             self.execute_set_isolation_level()
 
 
+class _Batches:
+    """The callbacks of pgtransaction.on_commit_batch for one transaction.
+
+    Each callback is registered with Django's on_commit so that it is dropped
+    with its savepoint or transaction. A flush hook is registered after each
+    callback, and only the latest one flushes.
+    """
+
+    def __init__(self):
+        self.callbacks = {}
+        self.savepoint_ids = None
+        self.generation = 0
+        self.hook = None
+
+    def collect(self, batch, key, func):
+        self.callbacks.setdefault(batch, {}).setdefault(key, func)
+
+    def is_pending(self, connection):
+        return any(hook is self.hook for _, hook, *_ in reversed(connection.run_on_commit))
+
+    def flush(self, generation):
+        if generation != self.generation:
+            return
+
+        # Don't keep the callbacks on the connection once they have run
+        callbacks, self.callbacks = self.callbacks, {}
+        for batch, batch_callbacks in callbacks.items():
+            _flush_batch(batch, list(batch_callbacks.values()))
+
+
+def _flush_batch(batch, callbacks):
+    if batch is None:
+        for callback in callbacks:
+            callback()
+    else:
+        batch(callbacks)
+
+
 def atomic(
     using: Union[str, None] = None,
     savepoint: bool = True,
@@ -192,3 +241,81 @@ def atomic(
             isolation_level,
             retry,
         )
+
+
+def on_commit_batch(
+    func: Callable[[], Any],
+    key: Union[Hashable, None] = None,
+    batch: Union[Callable[[List[Callable[[], Any]]], Any], None] = None,
+    using: Union[str, None] = None,
+):
+    """
+    Register a callback to run in a batch after the transaction commits.
+
+    Callbacks are collected by key and deduplicated. After the transaction
+    commits, the callbacks of each batch handler are passed to it as a list
+    in one call. Callbacks registered in a rolled back transaction, savepoint,
+    or failed retry attempt are dropped, exactly like
+    `django.db.transaction.on_commit`.
+
+    Args:
+        func: The callback.
+        key: The key used to deduplicate callbacks of the same batch handler.
+            Only the first callback registered for a key is kept. Must be
+            hashable. Defaults to the callback itself.
+        batch: A function that receives the list of callbacks after commit.
+            If `None`, the deduplicated callbacks are called in the order they
+            were registered.
+        using: The database to use.
+
+    Example:
+        Enqueue one task per row, but send them to the broker in one call
+        after the transaction commits:
+
+            def enqueue_many(callbacks):
+                broker.send_many([callback() for callback in callbacks])
+
+            @pgtransaction.atomic(retry=3)
+            def update(trades):
+                for trade in trades:
+                    ...
+                    pgtransaction.on_commit_batch(
+                        functools.partial(make_task, trade.id),
+                        key=trade.id,
+                        batch=enqueue_many,
+                    )
+
+        Each batch handler is called after the callbacks that were registered
+        with `django.db.transaction.on_commit` before the last call to
+        [pgtransaction.on_commit_batch][]. Outside of a transaction, the callback
+        is passed to the batch handler immediately.
+    """
+    connection = transaction.get_connection(using)
+    key = func if key is None else key
+    hash(key)
+
+    if not connection.in_atomic_block:
+        # Django validates that autocommit is on before running the callback
+        transaction.on_commit(partial(_flush_batch, batch, [func]), using=using)
+        return
+
+    batches = getattr(connection, "pgtransaction_batches", None)
+    if batches is None or not batches.is_pending(connection):
+        # The latest flush hook is gone after a commit or rollback, so this is a
+        # new transaction
+        batches = connection.pgtransaction_batches = _Batches()
+
+    transaction.on_commit(partial(batches.collect, batch, key, func), using=using)
+
+    # The latest flush hook is only dropped with a savepoint that every collected
+    # callback was registered in. Hooks are only appended so that the ones captured
+    # by Django's captureOnCommitCallbacks keep their positions
+    savepoint_ids = set(connection.savepoint_ids)
+    if batches.savepoint_ids is not None:
+        savepoint_ids &= batches.savepoint_ids
+
+    batches.savepoint_ids = savepoint_ids
+    batches.generation += 1
+    batches.hook = partial(batches.flush, batches.generation)
+    transaction.on_commit(batches.hook, using=using)
+    connection.run_on_commit[-1] = (savepoint_ids, *connection.run_on_commit[-1][1:])